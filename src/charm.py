@@ -12,11 +12,14 @@ develop a new k8s charm using the Operator Framework:
     https://discourse.charmhub.io/t/4208
 """
 
+import copy
+import functools
+import json
 import logging
-from typing import Optional
+import os
+from typing import Mapping, Optional, Tuple
 
 import yaml
-from minio import Minio
 from ops.charm import (
     CharmBase,
     PebbleReadyEvent,
@@ -31,6 +34,7 @@ from ops.model import (
     BlockedStatus,
     MaintenanceStatus,
     RelationDataContent,
+    StatusBase,
     WaitingStatus,
     ModelError,
 )
@@ -44,33 +48,60 @@ from serialized_data_interface import (
 
 from charms.nginx_ingress_integrator.v0.ingress import IngressRequires
 
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
 DEFAULT_BACKEND_STORE_URI = "sqlite:///mlflow.db"
 DEFAULT_ARTIFACT_ROOT = "./mlruns"
 MINIO_BUCKET = "mlflow"
+MINIO_TIMEOUT = 10  # seconds
 
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=32)
+def _load_minio_secrets(raw_data: str) -> dict:
+    """Load minio relation data, the result is cached by the raw string.
+
+    JSON is a subset of YAML, so the faster JSON parser is tried first. Data which are
+    not a mapping are loaded as empty dictionary.
+    """
+    try:
+        secrets = json.loads(raw_data)
+    except ValueError:
+        secrets = yaml.load(raw_data, Loader=_Loader)
+
+    return dict(secrets) if isinstance(secrets, Mapping) else {}
+
+
+def _parse_minio_secrets(raw_data: str) -> dict:
+    """Parse minio relation data.
+
+    Juju starts a new process for every hook, so the cache only helps when the same data
+    are parsed more than once within one dispatch (e.g. with deferred events). A copy is
+    returned, so the cached data can not be modified by the caller; for this small payload
+    the copy costs about as much as parsing it again with libyaml.
+    """
+    return copy.deepcopy(_load_minio_secrets(raw_data))
+
+
 class MlflowCharm(CharmBase):
     """Charm the service."""
     _stored = StoredState()
 
     def __init__(self, *args):
         super().__init__(*args)
-        # set interfaces
-        try:
-            self.interfaces = get_interfaces(self)
-        except NoVersionsListed as error:
-            # This is a transient error that will be resolved in the next run.
-            self.model.unit.status = WaitingStatus(str(error))
-            return
-        except NoCompatibleVersions as error:
-            self.model.unit.status = BlockedStatus(str(error))
-            return
-        except ModelError:
-            # if minio relation is removed
-            #   ops.model.ModelError: b'ERROR "" is not a valid unit or application\n'
-            pass
+        # cache of the Pebble layer as (inputs, layer)
+        self._layer_cache: Optional[Tuple[tuple, dict]] = None
+        # copy of the stored minio environment, replaced by the object-storage handlers
+        self._minio_env_snapshot: Optional[dict] = None
+        # the server layer and ingress are applied once per hook, see `_on_pre_commit`
+        self._layer_dirty = False
+        self._pre_commit_observed = False
+        # status set if relation interfaces can not be used, see `interfaces`
+        self._interfaces_status: Optional[StatusBase] = None
         # install operator and prepare services
         self.framework.observe(self.on.install, self._on_install)
         self.framework.observe(self.on.server_pebble_ready, self._on_server_pebble_ready)
@@ -89,22 +120,99 @@ class MlflowCharm(CharmBase):
         self._stored.set_default(
             backend_store_uri=DEFAULT_BACKEND_STORE_URI,
             artifact_root=DEFAULT_ARTIFACT_ROOT,
-            minio_environment={})
+            minio_environment={},
+            current_plan_services=None,
+            ingress_config=None,
+            pending_bucket=None)
+        if self._stored.pending_bucket is not None:
+            self._observe_pre_commit()
         # initialise ingress
         self.ingress = IngressRequires(self, {
             "service-hostname": self.config["host"],
             "service-name": self.app.name,
             "service-port": self.config["port"]
         })
-        self.unit.status = ActiveStatus("MLflow server is ready")
+
+    @functools.cached_property
+    def interfaces(self):
+        """Relation interfaces, which are loaded only by events that need them.
+
+        If the interfaces can not be used, the status is kept for `_check_interfaces`.
+        """
+        try:
+            return get_interfaces(self)
+        except NoVersionsListed as error:
+            # This is a transient error that will be resolved in the next run.
+            self._interfaces_status = WaitingStatus(str(error))
+        except NoCompatibleVersions as error:
+            self._interfaces_status = BlockedStatus(str(error))
+        except ModelError:
+            # if minio relation is removed
+            #   ops.model.ModelError: b'ERROR "" is not a valid unit or application\n'
+            pass
+
+        return None
+
+    def _check_interfaces(self) -> bool:
+        """Check if relation interfaces can be used, otherwise keep the unit Waiting/Blocked.
+
+        The "MLflow server is ready" status must not be set without this check, since
+        the interfaces are not loaded during initialisation.
+        """
+        if self.interfaces is None and self._interfaces_status is not None:
+            self.unit.status = self._interfaces_status
+            return False
+
+        return True
 
     @staticmethod
     def _create_bucket(endpoint: str, access_key: str, secret_key, secure: bool):
         """Create bucket for MLflow server."""
-        client = Minio(endpoint, access_key=access_key, secret_key=secret_key, secure=secure)
+        # imported here, because minio is needed only by object-storage relation
+        import certifi
+        import urllib3
+        from minio import Minio
+
+        # the same client as minio default, but minio waits up to 5 minutes and retries
+        # 5 times, which would block the whole hook
+        http_client = urllib3.PoolManager(
+            timeout=urllib3.Timeout(connect=MINIO_TIMEOUT, read=MINIO_TIMEOUT),
+            maxsize=10,
+            cert_reqs="CERT_REQUIRED",
+            ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+            retries=urllib3.Retry(total=1, backoff_factor=0.2,
+                                  status_forcelist=[500, 502, 503, 504]),
+        )
+        client = Minio(endpoint, access_key=access_key, secret_key=secret_key, secure=secure,
+                       http_client=http_client)
         if not client.bucket_exists(MINIO_BUCKET):
             client.make_bucket(MINIO_BUCKET)
 
+    def _ensure_bucket(self) -> bool:
+        """Create the pending bucket for MLflow server and return True if it was created.
+
+        A failed attempt leaves the bucket pending, so it is retried by the next hook.
+        """
+        bucket = self._stored.pending_bucket
+        if bucket is None:
+            return False
+
+        from minio.error import MinioException
+        from urllib3.exceptions import HTTPError
+
+        try:
+            self._create_bucket(bucket["endpoint"], bucket["access-key"],
+                                bucket["secret-key"], bucket["secure"])
+        except (MinioException, HTTPError) as error:
+            logger.warning("Failed to create Minio bucket: %s", error)
+            # a blocked status, e.g. set by `_apply_config` in this hook, is more severe
+            if not isinstance(self.unit.status, BlockedStatus):
+                self.unit.status = WaitingStatus("Minio bucket is not ready.")
+            return False
+
+        self._stored.pending_bucket = None
+        return True
+
     def _on_install(self, _):
         """Install on charm."""
         self.unit.status = WaitingStatus("The Pebble plan need to be created.")
@@ -125,7 +233,7 @@ class MlflowCharm(CharmBase):
                 user=mysql.get("user"), password=mysql.get("password"),
                 host=mysql.get("host"), port=mysql.get("port"), database=mysql.get("database")
             )
-        self._on_config_changed(event)
+        self._mark_layer_dirty()
 
     def _on_mysql_relation_broken(self, event: RelationChangedEvent):
         """Handle DB relation changed event."""
@@ -133,29 +241,37 @@ class MlflowCharm(CharmBase):
             return
 
         self._stored.backend_store_uri = DEFAULT_BACKEND_STORE_URI
-        self._on_config_changed(event)
+        self._mark_layer_dirty()
 
     def _object_storage_relation_changed(self, event: RelationChangedEvent):
         """Handle minio relation changed event."""
-        if not self.unit.is_leader():
+        if not self.unit.is_leader() or not self._check_interfaces():
             return
 
-        secrets = yaml.safe_load(event.relation.data.get(event.app, {}).get("data", "{}"))
+        raw_data = event.relation.data.get(event.app, {}).get("data", "{}")
+        secrets = _parse_minio_secrets(raw_data)
         if "service" not in secrets:
             self.unit.status = WaitingStatus("Minio data are missing.")
             return
 
         endpoint = f"{secrets['service']}:{secrets['port']}"
-        self._stored.minio_environment.update({
+        minio_environment = dict(self._stored.minio_environment)
+        minio_environment.update({
             "MLFLOW_S3_ENDPOINT_URL": f"http://{endpoint}",
             "AWS_ACCESS_KEY_ID": secrets["access-key"],
             "AWS_SECRET_ACCESS_KEY": secrets["secret-key"],
             "MLFLOW_S3_IGNORE_TLS": "false" if secrets["secure"] is True else "true"
         })
+        self._stored.minio_environment = minio_environment
+        self._minio_env_snapshot = minio_environment
         self._stored.artifact_root = f"s3://{MINIO_BUCKET}/"
-        self._create_bucket(endpoint, secrets["access-key"],
-                            secrets["secret-key"], secrets["secure"])
-        self._on_config_changed(event)
+        # the bucket is checked and created in `_on_pre_commit`, after the layer update
+        self._stored.pending_bucket = {
+            "endpoint": endpoint, "access-key": secrets["access-key"],
+            "secret-key": secrets["secret-key"], "secure": secrets["secure"],
+        }
+
+        self._mark_layer_dirty()
 
     def _object_storage_relation_broken(self, event: RelationBrokenEvent):
         """Handle minio relation broken event."""
@@ -163,44 +279,64 @@ class MlflowCharm(CharmBase):
             return
 
         self._stored.minio_environment = {}
+        self._minio_env_snapshot = {}
         self._stored.artifact_root = DEFAULT_ARTIFACT_ROOT
-        self._on_config_changed(event)
+        self._stored.pending_bucket = None
+        self._mark_layer_dirty()
 
     def _mlflow_layer(self):
         """Returns a Pebble configuration layer for Mlflow."""
         port = self.config["port"]
         backend_store_uri = self._stored.backend_store_uri
         artifact_root = self._stored.artifact_root
-        environment = dict(self._stored.minio_environment)
+        if self._minio_env_snapshot is None:
+            self._minio_env_snapshot = dict(self._stored.minio_environment)
+
+        environment = self._minio_env_snapshot
+        key = (port, backend_store_uri, artifact_root, frozenset(environment.items()))
+        if self._layer_cache is not None and self._layer_cache[0] == key:
+            return dict(self._layer_cache[1])
+
+        # the service is built without empty fields, so it matches the form of Pebble plan
+        command = " ".join((
+            "/bin/sh -c \"mlflow server",
+            "--host 0.0.0.0",
+            f"--port {port}",
+            f"--backend-store-uri {backend_store_uri}",
+            f"--default-artifact-root {artifact_root}",
+            "|| exit 2\"",
+        ))
+        server_service = {
+            "override": "replace",
+            "summary": "MLflow server",
+            "command": command,
+            "startup": "enabled",
+        }
+        if environment:
+            server_service["environment"] = environment
 
-        return {
+        layer = {
             "summary": "MLflow server layer",
             "description": "pebble config layer for MLflow server",
-            "services": {
-                "server": {
-                    "override": "replace",
-                    "summary": "MLflow server",
-                    "command": "/bin/sh -c \"mlflow server "
-                               f"--host 0.0.0.0 "
-                               f"--port {port} "
-                               f"--backend-store-uri {backend_store_uri} "
-                               f"--default-artifact-root {artifact_root} "
-                                "|| exit 2\"",
-                    "startup": "enabled",
-                    "environment": environment
-                }
-            }
+            "services": {"server": server_service}
         }
+        self._layer_cache = (key, layer)
+        return dict(layer)
 
     def _manage_server_layer(self):
-        """Manage MLflow server layer with Pebble."""
+        """Manage MLflow server layer with Pebble.
+
+        This runs on every unit, since each unit has its own server container. Once the layer
+        is applied, the Pebble plan is not fetched again until the layer inputs change or
+        the container is restarted, so follower units skip the plan diff on later events.
+        """
         container = self.unit.get_container("server")
         mlflow_layer = self._mlflow_layer()
-        services = container.get_plan().to_dict().get("services", {})
-        actual_services = {service: {key: value for key, value in fields.items() if value}
-                           for service, fields in mlflow_layer["services"].items()}
+        if self._stored.current_plan_services == mlflow_layer["services"]:
+            return
 
-        if services != actual_services:
+        services = container.get_plan().to_dict().get("services", {})
+        if services != mlflow_layer["services"]:
             self.unit.status = MaintenanceStatus("MLflow server maintenance")
             container.add_layer("mlflow-server", mlflow_layer, combine=True)
             if container.get_service("server").is_running():
@@ -209,9 +345,16 @@ class MlflowCharm(CharmBase):
 
             container.start("server")
 
+        self._stored.current_plan_services = mlflow_layer["services"]
+
     def _on_server_pebble_ready(self, event: PebbleReadyEvent):
         """Start a workload using the Pebble API."""
         # TODO: install mlflow in container or check if it's installed
+        if not self._check_interfaces():
+            return
+
+        # the container could be restarted with an empty plan, so the plan must be checked
+        self._stored.current_plan_services = None
         try:
             self._manage_server_layer()
         except (TimeoutError, ConnectionError, APIError):
@@ -228,15 +371,58 @@ class MlflowCharm(CharmBase):
 
     def _on_config_changed(self, _):
         """Handle the config-changed event."""
+        self._mark_layer_dirty()
+
+    def _mark_layer_dirty(self):
+        """Mark the server layer and ingress to be applied in `_on_pre_commit`."""
+        self._layer_dirty = True
+        self._observe_pre_commit()
+
+    def _observe_pre_commit(self):
+        """Observe the pre-commit event, only if there are pending changes.
+
+        With Juju storage, each observed event is saved and removed by extra hook tool
+        calls, so hooks without any pending changes do not observe it.
+        """
+        if not self._pre_commit_observed:
+            self.framework.observe(self.framework.on.pre_commit, self._on_pre_commit)
+            self._pre_commit_observed = True
+
+    def _on_pre_commit(self, _):
+        """Apply pending changes at most once per hook.
+
+        Relation and config handlers only mark the layer as dirty, so a burst of events
+        dispatched within one hook (e.g. deferred events) results in a single Pebble update.
+        The Minio bucket is created after that, so it does not delay the server restart.
+        """
+        layer_applied = self._layer_dirty
+        if self._layer_dirty:
+            self._layer_dirty = False
+            self._apply_config()
+
+        if self._ensure_bucket() and not layer_applied:
+            # a failed attempt in an earlier hook left the unit waiting for the bucket
+            self._apply_config()
+
+    def _apply_config(self):
+        """Apply the server layer and ingress configuration."""
+        if not self._check_interfaces():
+            return
+
         try:
             self._manage_server_layer()
         except (TimeoutError, ConnectionError, APIError):
             self.unit.status = BlockedStatus("Pebble API connection problem.")
             return
 
-        self.ingress.update_config({
+        # the layer is compared with the applied one in `_manage_server_layer`, ingress here
+        ingress_config = {
             "service-hostname": self.config["host"], "service-port": self.config["port"]
-        })
+        }
+        if self.unit.is_leader() and self._stored.ingress_config != ingress_config:
+            self.ingress.update_config(ingress_config)
+            self._stored.ingress_config = ingress_config
+
         self.unit.status = ActiveStatus("MLflow server is ready")
 
     def _dp_upgrade_action(self, event: ActionEvent):
@@ -246,6 +432,10 @@ class MlflowCharm(CharmBase):
                        "performing this action.")
             return
 
+        if not self._check_interfaces():
+            event.fail("Relation interfaces are not ready.")
+            return
+
         container = self.unit.get_container("server")
 
         if not container.get_service("server").is_running():
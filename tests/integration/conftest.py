@@ -0,0 +1,138 @@
+import shutil
+
+import pymysql
+import pytest
+from filelock import FileLock
+from minio import Minio
+
+MINIO_ACCESS_KEY = "minio"
+MINIO_SECRET_KEY = "minio1234"
+
+
+def pytest_configure(config):
+    """Use a separate Juju model for each xdist worker."""
+    worker_input = getattr(config, "workerinput", None)
+    if worker_input is not None and config.option.model:
+        config.option.model = f"{config.option.model}-{worker_input['workerid']}"
+
+
+@pytest.fixture(scope="session")
+def charm_dir(tmp_path_factory, testrun_uid):
+    """Directory shared by all workers of the test run to store the built charm."""
+    path = tmp_path_factory.getbasetemp().parent / f"charm-{testrun_uid}"
+    path.mkdir(exist_ok=True)
+    return path
+
+
+@pytest.fixture(scope="module")
+async def mlflow_charm(ops_test, charm_dir):
+    """Build the mlflow charm only once per test run."""
+    with FileLock(str(charm_dir / "build.lock")):
+        charm = next(charm_dir.glob("*.charm"), None)
+        if charm is None:
+            built_charm = await ops_test.build_charm(".")
+            charm = charm_dir / built_charm.name
+            shutil.move(str(built_charm), str(charm))
+
+    return charm
+
+
+async def _juju_deploy(ops_test, *args):
+    """Deploy an application to the model of this worker with Juju CLI."""
+    rc, stdout, stderr = await ops_test._run(
+        "juju", "deploy", *args, "-m", ops_test.model_full_name
+    )
+    assert rc == 0, f"Failed to deploy with resource: {stderr or stdout}"
+
+
+@pytest.fixture(scope="module")
+async def deployment(ops_test, mlflow_charm):
+    """Deploy mlflow to the model of this worker.
+
+    Other applications are deployed by their own fixtures, so each worker deploys only
+    the applications needed by its test groups.
+    """
+    # work around bug https://bugs.launchpad.net/juju/+bug/1928796
+    await _juju_deploy(ops_test, mlflow_charm,
+                       "--resource", "server=blueunicorn90/mlflow-operator:1.18",
+                       "--channel", "edge")
+    await ops_test.model.wait_for_idle(apps=["mlflow"], wait_for_active=True)
+    return ops_test.model
+
+
+@pytest.fixture(scope="module")
+async def ingress(ops_test, deployment):
+    """Deploy Nginx Ingress Integrator next to mlflow."""
+    # work around bug https://github.com/juju/python-libjuju/issues/511
+    await _juju_deploy(ops_test, "nginx-ingress-integrator", "ingress", "--channel", "stable")
+    await ops_test.model.wait_for_idle(apps=["ingress"], wait_for_active=True)
+    return ops_test.model.applications["ingress"]
+
+
+@pytest.fixture(scope="module")
+async def minio(ops_test, deployment):
+    """Deploy Minio next to mlflow."""
+    await _juju_deploy(ops_test, "cs:minio-55", "minio", "--channel", "stable")
+    await ops_test.model.wait_for_idle(apps=["minio"], wait_for_active=True)
+    return ops_test.model.applications["minio"]
+
+
+@pytest.fixture(scope="module")
+async def mariadb(ops_test, deployment):
+    """Deploy MariaDB next to mlflow."""
+    await _juju_deploy(ops_test, "cs:~charmed-osm/mariadb-k8s-35", "mariadb-k8s",
+                       "--channel", "stable")
+    await ops_test.model.wait_for_idle(apps=["mariadb-k8s"], wait_for_active=True)
+    return ops_test.model.applications["mariadb-k8s"]
+
+
+@pytest.fixture(scope="module")
+def mariadb_connect():
+    """Connect to mariadb-k8s, the connection is reused by all tests in the module."""
+    connections = {}
+
+    def _connect(host):
+        connection = connections.get(host)
+        if connection is None:
+            connection = connections[host] = pymysql.connect(
+                host=host,
+                port=3306,
+                user="root",
+                password="root",
+                db="database",
+            )
+        else:
+            connection.ping(reconnect=True)
+
+        return connection
+
+    yield _connect
+
+    for connection in connections.values():
+        connection.close()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def minio_credentials():
+    """Set the Minio credentials used by MLflow client once for the whole session."""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("AWS_ACCESS_KEY_ID", MINIO_ACCESS_KEY)
+        monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", MINIO_SECRET_KEY)
+        monkeypatch.setenv("MLFLOW_S3_IGNORE_TLS", "true")
+        yield
+
+
+@pytest.fixture(scope="module")
+def minio_client():
+    """Create Minio client, the client is reused by all tests in the module."""
+    clients = {}
+
+    def _client(address):
+        client = clients.get(address)
+        if client is None:
+            client = clients[address] = Minio(f"{address}:9000", access_key=MINIO_ACCESS_KEY,
+                                              secret_key=MINIO_SECRET_KEY, secure=False)
+
+        return client
+
+    return _client
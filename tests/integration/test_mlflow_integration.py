@@ -1,56 +1,95 @@
+import asyncio
 import logging
 import os
 import random
 import re
-import tempfile
+import time
 
 import mlflow
 import pytest
-import pymysql
-from minio import Minio
+from juju.errors import JujuAgentError, JujuUnitError
+from mlflow.entities import Metric, Param
+from mlflow.tracking import MlflowClient
 
 log = logging.getLogger(__name__)
+_IP_RE = re.compile(r"[0-9]+(?:\.[0-9]+){3}")
 
 
 def _get_ip(text):
     """Get subnet IP address."""
-    try:
-        return re.findall(r"[0-9]+(?:\.[0-9]+){3}", text)[0]
-    except IndexError:
-        return None
+    match = _IP_RE.search(text)
+    return match.group(0) if match else None
 
 
-def _run_test_train():
+async def _wait_active(model, timeout=600, idle_period=15):
+    """Wait until all units are active and have been idle for `idle_period` seconds.
+
+    Unit changes are observed from the Juju delta stream, so no status is requested from
+    the controller. Every unit change restarts the idle period, as `wait_for_idle` does,
+    so hooks which start late or finish between two checks are not missed. A unit in
+    error or blocked state fails the wait immediately, as in `wait_for_idle`.
+    """
+    loop = asyncio.get_running_loop()
+    last_change = loop.time()
+
+    async def _on_unit_change(*_):
+        nonlocal last_change
+        last_change = loop.time()
+
+    def _settled():
+        units = [unit for application in model.applications.values()
+                 for unit in application.units]
+        for unit in units:
+            if unit.workload_status in ("error", "blocked"):
+                raise JujuUnitError(f"{unit.name} is in {unit.workload_status} state: "
+                                    f"{unit.workload_status_message}")
+            if unit.agent_status == "error":
+                raise JujuAgentError(f"{unit.name} agent is in error state")
+
+        return loop.time() - last_change >= idle_period and all(
+            unit.workload_status == "active" and unit.agent_status == "idle" for unit in units
+        )
+
+    model.add_observer(_on_unit_change, entity_type="unit")
+    await model.block_until(_settled, timeout=timeout)
+
+
+async def _run_test_train():
     """Run test train."""
+    client = MlflowClient()
     experiment_id = mlflow.create_experiment(f"experiment-{random.randint(0, 1000):04d}")
     with mlflow.start_run(experiment_id=experiment_id) as run:
-        mlflow.log_params({"param1": 1, "param2": 2})
-        mlflow.log_metric("score", 0.8)
-        with tempfile.TemporaryDirectory() as tmpdir:
-            local_artifact_path = os.path.join(tmpdir, "test")
-            with open(local_artifact_path, "w") as file:
-                file.write(str(random.randint(0, 10)))
-
-            mlflow.log_artifact(local_artifact_path)
+        run_id = run.info.run_id
+        metrics = [Metric("score", 0.8, int(time.time() * 1000), 0)]
+        params = [Param("param1", "1"), Param("param2", "2")]
+        # the artifact is uploaded from memory, without a temporary file
+        await asyncio.gather(
+            asyncio.to_thread(client.log_batch, run_id, metrics=metrics, params=params),
+            asyncio.to_thread(client.log_text, run_id, str(random.randint(0, 10)), "test"),
+        )
 
-        return run.info.run_id
+        return run_id
 
 
 async def _check_mlflow_server(model, use_ingress=False):
     """Validate that the mlflow server is working correctly."""
     if use_ingress:
+        mlflow_config = await model.applications["mlflow"].get_config()
         mlflow_host = _get_ip(model.applications["ingress"].units[0].workload_status_message)
         assert mlflow_host is not None, "Failed to get IP address from ingress unit."
     else:
-        status = await model.get_status()
+        # the status and the config are independent, so they are requested concurrently
+        status, mlflow_config = await asyncio.gather(
+            model.get_status(),
+            model.applications["mlflow"].get_config(),
+        )
         mlflow_host = status.applications["mlflow"].units["mlflow/0"].address
 
-    mlflow_config = await model.applications["mlflow"].get_config()
     mlflow_port = mlflow_config.get("port", {}).get("value")
 
     mlflow.set_tracking_uri(f"http://{mlflow_host}:{mlflow_port}")
-    run_id = _run_test_train()
-    run = mlflow.get_run(run_id)
+    run_id = await _run_test_train()
+    run = await asyncio.to_thread(mlflow.get_run, run_id)
 
     assert run.info.status == "FINISHED"
     assert run.data.metrics == {"score": 0.8}
@@ -61,35 +100,16 @@ async def _check_mlflow_server(model, use_ingress=False):
 
 
 @pytest.mark.abort_on_fail
-async def test_build_and_deploy(ops_test):
-    """Build and deploy Flannel in bundle."""
-    mlflow_operator = await ops_test.build_charm(".")
-    # work around bug https://bugs.launchpad.net/juju/+bug/1928796
-    rc, stdout, stderr = await ops_test._run(
-        "juju",
-        "deploy",
-        mlflow_operator,
-        "-m", ops_test.model_full_name,
-        "--resource", "server=blueunicorn90/mlflow-operator:1.18",
-        "--channel", "edge"
-    )
-    assert rc == 0, f"Failed to deploy with resource: {stderr or stdout}"
-    await ops_test.model.deploy(ops_test.render_bundle(
-        "tests/data/bundle.yaml", master_charm=mlflow_operator))
-    # work around bug https://github.com/juju/python-libjuju/issues/511
-    rc, stdout, stderr = await ops_test._run(
-        "juju",
-        "deploy",
-        "nginx-ingress-integrator",
-        "ingress",
-        "-m", ops_test.model_full_name,
-        "--channel", "stable"
-    )
-    assert rc == 0, f"Failed to deploy with resource: {stderr or stdout}"
-    await ops_test.model.wait_for_idle(wait_for_active=True)
+@pytest.mark.xdist_group("base")
+async def test_build_and_deploy(ops_test, deployment):
+    """Build and deploy mlflow."""
+    for application in ops_test.model.applications.values():
+        for unit in application.units:
+            assert unit.workload_status == "active", f"{unit.name} is not active"
 
 
-async def test_mlflow_status_message(ops_test):
+@pytest.mark.xdist_group("base")
+async def test_mlflow_status_message(ops_test, deployment):
     """Validate mlflow status message."""
     unit = ops_test.model.applications["mlflow"].units[0]
     assert unit.workload_status == "active"
@@ -97,82 +117,76 @@ async def test_mlflow_status_message(ops_test):
     await _check_mlflow_server(ops_test.model)
 
 
-async def test_add_ingress_relations(ops_test):
+@pytest.mark.xdist_group("ingress")
+async def test_add_ingress_relations(ops_test, ingress):
     """Validate that adding the Nginx Ingress Integrator relations works."""
     await ops_test.model.add_relation("mlflow", "ingress")
-    await ops_test.model.wait_for_idle(wait_for_active=True)
+    await _wait_active(ops_test.model)
     await _check_mlflow_server(ops_test.model, use_ingress=True)
 
 
-async def test_remove_ingress_relations(ops_test):
+@pytest.mark.xdist_group("ingress")
+async def test_remove_ingress_relations(ops_test, ingress):
     """Validate that removing the Nginx Ingress Integrator relations works."""
-    ingress_application = ops_test.model.applications["ingress"]
-    await ingress_application.destroy_relation("ingress", "mlflow")
-    await ops_test.model.wait_for_idle(wait_for_active=True)
+    await ingress.destroy_relation("ingress", "mlflow")
+    await _wait_active(ops_test.model)
     await _check_mlflow_server(ops_test.model)
 
 
-async def test_add_minio_relations(ops_test):
+@pytest.mark.xdist_group("minio")
+async def test_add_minio_relations(ops_test, minio, minio_client):
     """Validate that adding the Minio relation works."""
-    await ops_test.model.add_relation("mlflow", "minio")
-    await ops_test.model.wait_for_idle(wait_for_active=True)
-
-    # configuration environment variables before test run
-    minio_app = ops_test.model.applications["minio"]
-    await minio_app.set_config({"secret-key": "minio1234"})
-    await ops_test.model.wait_for_idle(wait_for_active=True)
-
-    status = await ops_test.model.get_status()
-    minio_ip = status.applications["minio"].units["minio/0"].address
-    os.environ["MLFLOW_S3_ENDPOINT_URL"] = f"http://{minio_ip}:9000"
-    os.environ["AWS_ACCESS_KEY_ID"] = "minio"
-    os.environ["AWS_SECRET_ACCESS_KEY"] = "minio1234"
-    os.environ["MLFLOW_S3_IGNORE_TLS"] = "true"
+    model = ops_test.model
+    # the relation and the new secret key are applied together, every unit change (including
+    # the minio pod restart) restarts the idle period of the single wait
+    await asyncio.gather(
+        model.add_relation("mlflow", "minio"),
+        minio.set_config({"secret-key": "minio1234"}),
+    )
+    await _wait_active(model)
 
+    # the address is read after the restart, since the minio pod could be rescheduled
+    status = await model.get_status()
+    minio_address = status.applications["minio"].units["minio/0"].address
+    # credentials are set for the whole session, see `minio_credentials` fixture
+    os.environ["MLFLOW_S3_ENDPOINT_URL"] = f"http://{minio_address}:9000"
     run = await _check_mlflow_server(ops_test.model)
 
-    client = Minio(f"{minio_ip}:9000", access_key="minio", secret_key="minio1234", secure=False)
+    client = minio_client(minio_address)
     assert client.bucket_exists("mlflow")
-    prefix = run.info.artifact_uri.replace("s3://mlflow/", "")
-    objects = [obj.object_name for obj in client.list_objects("mlflow", prefix, recursive=True)]
-    assert f"{prefix}/test" in objects
+    # trailing slash limits the listing to the artifacts directory of the run
+    prefix = run.info.artifact_uri.replace("s3://mlflow/", "").rstrip("/") + "/"
+    objects = client.list_objects("mlflow", prefix=prefix, recursive=True, start_after=prefix)
+    assert any(obj.object_name == f"{prefix}test" for obj in objects)
 
 
-async def test_remove_minio_relations(ops_test):
+@pytest.mark.xdist_group("minio")
+async def test_remove_minio_relations(ops_test, minio):
     """Validate that removing the Minio relations works."""
-    minio_application = ops_test.model.applications["minio"]
-    await minio_application.destroy_relation("object-storage", "mlflow")
-    await ops_test.model.wait_for_idle(wait_for_active=True)
+    await minio.destroy_relation("object-storage", "mlflow")
+    await _wait_active(ops_test.model)
     await _check_mlflow_server(ops_test.model)
 
 
-async def test_add_db_relations(ops_test):
+@pytest.mark.xdist_group("db")
+async def test_add_db_relations(ops_test, mariadb, mariadb_connect):
     """Validate that adding a DB relation works."""
     await ops_test.model.add_relation("mlflow", "mariadb-k8s")
-    await ops_test.model.wait_for_idle(wait_for_active=True)
+    await _wait_active(ops_test.model)
     run = await _check_mlflow_server(ops_test.model)
 
     status = await ops_test.model.get_status()
     mariadb_k8s_ip = status.applications["mariadb-k8s"].units["mariadb-k8s/0"].address
 
-    connection = pymysql.connect(
-        host=mariadb_k8s_ip,
-        port=3306,
-        user="root",
-        password="root",
-        db="database",
-        cursorclass=pymysql.cursors.DictCursor
-    )
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT run_uuid FROM runs;")
-            results = cursor.fetchall()
-            assert run.info.run_uuid in [result.get("run_uuid") for result in results]
+    connection = mariadb_connect(mariadb_k8s_ip)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM runs WHERE run_uuid=%s LIMIT 1;", (run.info.run_uuid,))
+        assert cursor.fetchone() is not None
 
 
-async def test_remove_db_relations(ops_test):
+@pytest.mark.xdist_group("db")
+async def test_remove_db_relations(ops_test, mariadb):
     """Validate that removing a DB relations works."""
-    db_application = ops_test.model.applications["mariadb-k8s"]
-    await db_application.destroy_relation("mysql", "mlflow")
-    await ops_test.model.wait_for_idle(wait_for_active=True)
+    await mariadb.destroy_relation("mysql", "mlflow")
+    await _wait_active(ops_test.model)
     await _check_mlflow_server(ops_test.model)